@@ -530,6 +530,10 @@ class SVGPaintEngine(qt.QPaintEngine):
         This is converted to a bitmap and embedded in the output
         """
 
+        # only output the part of the pixmap requested
+        if sr.toRect() != pixmap.rect():
+            pixmap = pixmap.copy(sr.toRect())
+
         # convert pixmap to textual data
         data = qt.QByteArray()
         buf = qt.QBuffer(data)
@@ -124,3 +124,31 @@ void rollingAverage(const Numpy1DObj& indata,
 	out[i] = std::numeric_limits<double>::quiet_NaN();
     }
 }
+
+void nanMinMax(const Numpy1DObj& indata, double* minval, double* maxval)
+{
+  double minv = std::numeric_limits<double>::quiet_NaN();
+  double maxv = std::numeric_limits<double>::quiet_NaN();
+
+  // find first non-NaN value
+  int i = 0;
+  for( ; i < indata.dim; ++i)
+    if( ! isNaN(indata(i)) )
+      {
+	minv = maxv = indata(i);
+	break;
+      }
+
+  // do both comparisons in the same pass through the data
+  for( ; i < indata.dim; ++i)
+    {
+      const double v = indata(i);
+      if( v < minv )
+	minv = v;
+      else if( v > maxv )
+	maxv = v;
+    }
+
+  *minval = minv;
+  *maxval = maxv;
+}
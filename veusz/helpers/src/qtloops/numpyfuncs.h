@@ -35,4 +35,8 @@ void rollingAverage(const Numpy1DObj& indata,
 		    int width,
 		    int* numoutbins, double** outdata);
 
+// find the minimum and maximum of the data in one pass, ignoring
+// NaN values (both are NaN if there are no other values)
+void nanMinMax(const Numpy1DObj& indata, double* minval, double* maxval);
+
 #endif
@@ -17,6 +17,10 @@
 /////////////////////////////////////////////////////////////////////////////
 
 #include <algorithm>
+#include <cmath>
+#include <cstring>
+#include <functional>
+#include <vector>
 
 #include "qtloops.h"
 #include "isnan.h"
@@ -28,6 +32,10 @@
 #include <QLineF>
 #include <QPen>
 #include <QPointF>
+#include <QRunnable>
+#include <QSemaphore>
+#include <QThread>
+#include <QThreadPool>
 #include <QTransform>
 #include <QVector>
 
@@ -321,8 +329,122 @@ void addCubicsToPainterPath(QPainterPath& path, const QPolygonF& poly)
     }
 }
 
+namespace
+{
+  typedef std::function<void(int, int)> RowFunc;
+
+  // calls a row function for a range of rows in a thread pool
+  class RowRunnable : public QRunnable
+  {
+  public:
+    RowRunnable(const RowFunc& func, int y1, int y2, QSemaphore& done)
+      : _func(func), _y1(y1), _y2(y2), _done(done)
+    {
+    }
+
+    void run()
+    {
+      _func(_y1, _y2);
+      _done.release();
+    }
+
+  private:
+    const RowFunc& _func;
+    int _y1, _y2;
+    QSemaphore& _done;
+  };
+
+  // call func(y1, y2) for ranges of rows covering 0 to yw
+  // large images are split between threads in the global thread pool
+  // (if no thread is free, the range is processed in this thread)
+  void forRowRanges(int xw, int yw, const RowFunc& func)
+  {
+    // minimum number of pixels each thread should process
+    const long long minpixels = 1<<18;
+
+    const int nthreads = int(std::min<long long>(
+      std::min<long long>(QThread::idealThreadCount(), yw),
+      (long long)(xw)*yw / minpixels));
+
+    if( nthreads <= 1 )
+      {
+	func(0, yw);
+	return;
+      }
+
+    QThreadPool* pool = QThreadPool::globalInstance();
+    QSemaphore done;
+    for(int i=1; i<nthreads; ++i)
+      {
+	RowRunnable* task = new RowRunnable(
+	  func, int((long long)(yw)*i/nthreads),
+	  int((long long)(yw)*(i+1)/nthreads), done);
+	if( ! pool->tryStart(task) )
+	  {
+	    task->run();
+	    delete task;
+	  }
+      }
+
+    // first range is done in this thread
+    func(0, yw/nthreads);
+    done.acquire(nthreads-1);
+  }
+
+  // write stepped colormap to an 8 bit indexed image
+  // the color table contains the bands, followed by a transparent
+  // entry used for non-finite values
+  QImage numpyToIndexedQImage(const Numpy2DObj& imgdata,
+			      const Numpy2DIntObj &colors)
+  {
+    const int numcolors = colors.dims[0];
+    const int xw = imgdata.dims[1];
+    const int yw = imgdata.dims[0];
+
+    // ignore 1st color, which signals stepped mode
+    QVector<QRgb> table;
+    for(int band=1; band<numcolors; ++band)
+      table << qRgba(colors(2, band), colors(1, band),
+		     colors(0, band), colors(3, band));
+    const uchar transidx = uchar(numcolors-1);
+    table << qRgba(0, 0, 0, 0);
+
+    QImage img(xw, yw, QImage::Format_Indexed8);
+    img.setColorTable(table);
+
+    // get pointer to data here, as scanLine can detach the image
+    uchar* bits = img.bits();
+    const int bpl = img.bytesPerLine();
+
+    forRowRanges(xw, yw, [&](int y1, int y2)
+      {
+	for(int y=y1; y<y2; ++y)
+	  {
+	    uchar* scanline = bits + (yw-y-1)*bpl;
+	    for(int x=0; x<xw; ++x)
+	      {
+		const double val = imgdata(x, y);
+		if( ! isFinite(val) )
+		  scanline[x] = transidx;
+		else
+		  {
+		    const int band = clipval(
+		      int(clipval(val, 0., 1.)*(numcolors-1))+1,
+		      1, numcolors-1);
+		    scanline[x] = uchar(band-1);
+		  }
+	      }
+	  }
+      });
+
+    return img;
+  }
+
+} // namespace
+
 QImage numpyToQImage(const Numpy2DObj& imgdata, const Numpy2DIntObj &colors,
-		     bool forcetrans)
+		     const Numpy2DObj* transdata, bool allowindexed,
+		     QImage* reuse)
 {
   // make format use alpha transparency if required
   const int numcolors = colors.dims[0];
@@ -337,77 +459,113 @@ QImage numpyToQImage(const Numpy2DObj& imgdata, const Numpy2DIntObj &colors,
   // if the first value in the color is -1 then switch to jumping mode
   const bool jumps = colors(0,0) == -1;
 
-  // make image
-  QImage img(xw, yw, QImage::Format_ARGB32);
+  // a stepped colormap without transparency data can be written as
+  // an indexed image, which is a quarter of the size
+  if( allowindexed && jumps && transdata == 0 && numcolors <= 256 )
+    return numpyToIndexedQImage(imgdata, colors);
 
-  // does the image use alpha values?
-  bool hasalpha = false;
+  // region of image covered by transparency data, if any
+  // (rows are counted from the bottom of the image, like the data)
+  const int transxw = transdata==0 ? 0 : std::min(transdata->dims[1], xw);
+  const int transyw = transdata==0 ? 0 : std::min(transdata->dims[0], yw);
 
-  // iterate over input pixels
-  for(int y=0; y<yw; ++y)
+  // make image, taking over the buffer of the image to reuse if it is
+  // the right size and nothing else refers to it
+  QImage img;
+#if QT_VERSION >= QT_VERSION_CHECK(5, 9, 0)
+  if( reuse != 0 && reuse->isDetached() &&
+      reuse->width() == xw && reuse->height() == yw &&
+      ( reuse->format() == QImage::Format_ARGB32 ||
+	reuse->format() == QImage::Format_RGB32 ) )
     {
-      // direction of images is different for qt and numpy image
-      QRgb* scanline = reinterpret_cast<QRgb*>(img.scanLine(yw-y-1));
-      for(int x=0; x<xw; ++x)
-	{
-	  double val = imgdata(x, y);
+      img.swap(*reuse);
+      img.reinterpretAsFormat(QImage::Format_ARGB32);
+    }
+  else
+#endif
+    img = QImage(xw, yw, QImage::Format_ARGB32);
+  uchar* bits = img.bits();
+  const int bpl = img.bytesPerLine();
 
-	  // output color
-	  int b, g, r, a;
+  // does each row use alpha values?
+  std::vector<char> rowalpha(yw, 0);
 
-	  if( ! isFinite(val) )
-	    {
-	      // transparent
-	      b = g = r = a = 0;
-	    }
-	  else
+  // iterate over input pixels (rows may be split between threads)
+  forRowRanges(xw, yw, [&](int y1, int y2)
+    {
+      for(int y=y1; y<y2; ++y)
+	{
+	  // direction of images is different for qt and numpy image
+	  QRgb* scanline = reinterpret_cast<QRgb*>(bits + (yw-y-1)*bpl);
+	  bool hasalpha = false;
+	  for(int x=0; x<xw; ++x)
 	    {
-	      val = clipval(val, 0., 1.);
+	      double val = imgdata(x, y);
 
-	      if( jumps )
+	      // output color
+	      int b, g, r, a;
+
+	      if( ! isFinite(val) )
 		{
-		  // jumps between colours in discrete mode
-		  // (ignores 1st color, which signals this mode)
-		  const int band = clipval(int(val*(numcolors-1))+1, 1,
-					   numcolors-1);
-
-		  b = colors(0, band);
-		  g = colors(1, band);
-		  r = colors(2, band);
-		  a = colors(3, band);
+		  // transparent
+		  b = g = r = a = 0;
 		}
 	      else
 		{
-		  // do linear interpolation between bands
-		  // make sure between 0 and 1
-
-		  const int band = clipval(int(val*numbands), 0, numbands-1);
-		  const double delta = val*numbands - band;
-
-		  // ensure we don't read beyond where we should
-		  const int band2 = std::min(band + 1, numbands);
-		  const double delta1 = 1.-delta;
-
-                  // we add 0.5 before truncating to round to nearest int
-		  b = int(delta1*colors(0, band) +
-			  delta *colors(0, band2) + 0.5);
-		  g = int(delta1*colors(1, band) +
-			  delta *colors(1, band2) + 0.5);
-		  r = int(delta1*colors(2, band) +
-			  delta *colors(2, band2) + 0.5);
-		  a = int(delta1*colors(3, band) +
-			  delta *colors(3, band2) + 0.5);
-	      
+		  val = clipval(val, 0., 1.);
+
+		  if( jumps )
+		    {
+		      // jumps between colours in discrete mode
+		      // (ignores 1st color, which signals this mode)
+		      const int band = clipval(int(val*(numcolors-1))+1, 1,
+					       numcolors-1);
+
+		      b = colors(0, band);
+		      g = colors(1, band);
+		      r = colors(2, band);
+		      a = colors(3, band);
+		    }
+		  else
+		    {
+		      // do linear interpolation between bands
+		      // make sure between 0 and 1
+
+		      const int band = clipval(int(val*numbands), 0, numbands-1);
+		      const double delta = val*numbands - band;
+
+		      // ensure we don't read beyond where we should
+		      const int band2 = std::min(band + 1, numbands);
+		      const double delta1 = 1.-delta;
+
+		      // we add 0.5 before truncating to round to nearest int
+		      b = int(delta1*colors(0, band) +
+			      delta *colors(0, band2) + 0.5);
+		      g = int(delta1*colors(1, band) +
+			      delta *colors(1, band2) + 0.5);
+		      r = int(delta1*colors(2, band) +
+			      delta *colors(2, band2) + 0.5);
+		      a = int(delta1*colors(3, band) +
+			      delta *colors(3, band2) + 0.5);
+		    }
 		}
-	    }
 
-          if(a != 255)
-            hasalpha = true;
+	      // apply transparency in the same pass
+	      const int ty = y - (yw - transyw);
+	      if( x < transxw && ty >= 0 )
+		a = int(a * clipval((*transdata)(x, ty), 0., 1.));
 
-	  *(scanline+x) = qRgba(r, g, b, a);
+	      if(a != 255)
+		hasalpha = true;
+
+	      *(scanline+x) = qRgba(r, g, b, a);
+	    }
+	  rowalpha[y] = hasalpha;
 	}
-    }
+    });
 
+  const bool hasalpha = std::find(rowalpha.begin(), rowalpha.end(), 1) !=
+    rowalpha.end();
 
   if(!hasalpha)
     {
@@ -447,37 +605,121 @@ void applyImageTransparancy(QImage& img, const Numpy2DObj& data)
     }
 }
 
-QImage resampleNonlinearImage(const QImage& img,
+namespace
+{
+  // Work out which input pixel each of the nout output pixels falls
+  // in, where the output pixels start at coordinate p0. If reverse is
+  // false, input pixel i lies between edges(i) and edges(i+1),
+  // otherwise between edges(dim-1-i) and edges(dim-2-i).
+  QVector<int> resampleIndices(const Numpy1DObj& edges, int p0, int nout,
+                               int maxidx, bool reverse)
+  {
+    // lower edge of pixel i (upper edge is edge(i+1))
+    const int last = edges.dim-1;
+    auto edge = [&edges, last, reverse](int i)
+      {
+        return reverse ? edges(last-i) : edges(i);
+      };
+
+    // are the pixels all the same size?
+    const double delta = edges.dim >= 2 ? edge(1)-edge(0) : 0.;
+    bool uniform = delta > 0;
+    for(int i=1; uniform && i<last; ++i)
+      if( std::abs(edge(i+1)-edge(i)-delta) > 1e-6*delta )
+        uniform = false;
+
+    QVector<int> idx(nout);
+    if( uniform )
+      {
+        // calculate each pixel directly, correcting for any rounding
+        // at the pixel edges
+        const double e0 = edge(0);
+        const double invdelta = 1./delta;
+        for(int o=0; o<nout; ++o)
+          {
+            const double c = o+p0+0.5;
+            int i = int(clipval(std::floor((c-e0)*invdelta),
+                                0., double(maxidx)));
+            if( i<maxidx && edge(i+1) <= c )
+              ++i;
+            else if( i>0 && edge(i) > c )
+              --i;
+            idx[o] = i;
+          }
+      }
+    else
+      {
+        // as the edges are monotonic, a single pass through them is
+        // needed
+        int i=0;
+        for(int o=0; o<nout; ++o)
+          {
+            while( i<maxidx && edge(i+1) <= o+p0+0.5 )
+              ++i;
+            idx[o] = i;
+          }
+      }
+    return idx;
+  }
+}
+
+QImage resampleNonlinearImage(const QImage& inimg,
                               int x0, int y0,
                               int x1, int y1,
                               const Numpy1DObj& xedge,
-                              const Numpy1DObj& yedge)
+                              const Numpy1DObj& yedge,
+                              int xoffset, int yoffset)
 {
   putinorder(x0, x1);
   putinorder(y0, y1);
 
+  // pixels are copied below as 32 bit values, so convert any other
+  // formats first
+  const QImage img = inimg.depth() == 32 ? inimg :
+    inimg.convertToFormat(QImage::Format_ARGB32);
+
   const int xw = x1-x0;
   const int yw = y1-y0;
 
   QImage outimg(xw, yw, img.format());
 
-  int iy=0;
-  for(int oy=0; oy<yw; ++oy)
+  // the edges give the pixels in the region of the input image
+  // starting at xoffset, yoffset, which is read directly rather than
+  // being copied out first
+  const int maxix = std::min(img.width()-xoffset, xedge.dim-1) - 1;
+  const int maxiy = std::min(img.height()-yoffset, yedge.dim-1) - 1;
+  if( xoffset < 0 || yoffset < 0 || maxix < 0 || maxiy < 0 )
     {
-      while( yedge(yedge.dim-2-iy)<=oy+y0+0.5 && iy<yedge.dim-1 )
-        ++iy;
+      outimg.fill(0);
+      return outimg;
+    }
+
+  // input column and row for each output column and row
+  // (the y edges go the opposite way to the image rows)
+  const QVector<int> xidx = resampleIndices(xedge, x0, xw, maxix, false);
+  const QVector<int> yidx = resampleIndices(yedge, y0, yw, maxiy, true);
+  const int* xidxptr = xidx.constData();
 
+  int lastiy=-1;
+  for(int oy=0; oy<yw; ++oy)
+    {
+      const int iy = yidx[oy];
       QRgb* oscanline = reinterpret_cast<QRgb*>(outimg.scanLine(oy));
-      const QRgb* iscanline = reinterpret_cast<const QRgb*>(img.scanLine(iy));
 
-      int ix=0;
-      for(int ox=0; ox<xw; ++ox)
+      if( iy == lastiy )
         {
-          while( xedge(ix+1)<=ox+x0+0.5 && ix<xedge.dim-1 )
-            ++ix;
-
-          oscanline[ox] = iscanline[ix];
+          // same input row as the last output row, so just copy it
+          std::memcpy(oscanline, outimg.constScanLine(oy-1),
+                      xw*sizeof(QRgb));
+          continue;
         }
+
+      const QRgb* iscanline =
+        reinterpret_cast<const QRgb*>(img.constScanLine(iy+yoffset)) +
+        xoffset;
+      for(int ox=0; ox<xw; ++ox)
+        oscanline[ox] = iscanline[xidxptr[ox]];
+      lastiy = iy;
     }
 
   return outimg;
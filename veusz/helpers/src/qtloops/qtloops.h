@@ -67,8 +67,15 @@ void plotBoxesToPainter(QPainter& painter,
 // add polygon to painter path as a cubic
 void addCubicsToPainterPath(QPainterPath& path, const QPolygonF& poly);
 
+// convert scaled data to an image using the colors given
+// if transdata is set, the alpha values are scaled by these values
+// if allowindexed is set, stepped colormaps may give an indexed image
+// if reuse is set, its buffer is used for the output if possible (reuse
+// is then left null)
 QImage numpyToQImage(const Numpy2DObj& data, const Numpy2DIntObj &colors,
-		     bool forcetrans = false);
+		     const Numpy2DObj* transdata = 0,
+		     bool allowindexed = false,
+		     QImage* reuse = 0);
 
 void applyImageTransparancy(QImage& img, const Numpy2DObj& data);
 
@@ -76,7 +83,8 @@ QImage resampleNonlinearImage(const QImage& img,
                               int x0, int y0,
                               int x1, int y1,
                               const Numpy1DObj& xedge,
-                              const Numpy1DObj& yedge);
+                              const Numpy1DObj& yedge,
+                              int xoffset=0, int yoffset=0);
 
 // plot image as a set of rectangles
 void plotImageAsRects(QPainter& painter, const QRectF& bounds, const QImage& img);
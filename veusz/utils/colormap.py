@@ -22,7 +22,7 @@ import numpy as N
 
 from .. import qtall as qt
 
-from ..helpers.qtloops import numpyToQImage, applyImageTransparancy
+from ..helpers.qtloops import numpyToQImage
 
 # Default colormaps used by widgets.
 # Each item in this dict is a colormap entry, with the key the name.
@@ -495,32 +495,39 @@ def applyScaling(data, mode, minval, maxval):
     if minval == maxval:
         minval, maxval = 0., 1.
         
+    # the operations below work in place on a single float64 output
+    # array (which is what numpyToQImage needs) to avoid temporaries
     if mode == 'linear':
         # linear scaling
-        data = (data - minval) * (1./(maxval - minval))
+        data = N.subtract(data, minval, dtype=N.float64)
+        data *= 1./(maxval - minval)
 
     elif mode == 'sqrt':
         # sqrt scaling
         # translate into fractions of range
-        data = (data - minval) * (1./(maxval - minval))
+        data = N.subtract(data, minval, dtype=N.float64)
+        data *= 1./(maxval - minval)
         # clip off any bad sqrts
-        data[data < 0.] = 0.
+        N.maximum(data, 0., out=data)
         # actually do the sqrt transform
-        data = N.sqrt(data)
+        N.sqrt(data, out=data)
 
     elif mode == 'log':
         # log scaling of image
         with N.errstate(invalid='ignore', divide='ignore'):
             invrange = 1./(N.log(maxval)-N.log(minval))
-            data = (N.log(data)-N.log(minval)) * invrange
+            data = N.log(data, dtype=N.float64)
+            data -= N.log(minval)
+            data *= invrange
         data[~N.isfinite(data)] = N.nan
 
     elif mode == 'squared':
         # squared scaling
         # clip any negative values
-        lowermin = data < minval
-        data = (data-minval)**2 / (maxval-minval)**2
-        data[lowermin] = 0.
+        data = N.subtract(data, minval, dtype=N.float64)
+        N.maximum(data, 0., out=data)
+        data *= data
+        data *= 1./(maxval-minval)**2
 
     else:
         raise RuntimeError('Invalid scaling mode "%s"' % mode)
@@ -528,7 +535,8 @@ def applyScaling(data, mode, minval, maxval):
     return data
 
 def applyColorMap(cmap, scaling, datain, minval, maxval,
-                  trans, transimg=None):
+                  trans, transimg=None, allowindexed=False,
+                  reuseimg=None):
     """Apply a colour map to the 2d data given.
 
     cmap is the color map (numpy of BGRalpha quads)
@@ -537,6 +545,10 @@ def applyColorMap(cmap, scaling, datain, minval, maxval,
     minval and maxval are the extremes of the data for the colormap
     trans is a number from 0 to 100
     transimg is an optional image to apply transparency from
+    allowindexed allows an 8 bit indexed image to be returned for
+     stepped colormaps (only if transimg is not given)
+    reuseimg is an optional image no longer needed by the caller, whose
+     buffer is reused for the output if possible (it is left null)
     Returns a QImage
     """
 
@@ -562,10 +574,8 @@ def applyColorMap(cmap, scaling, datain, minval, maxval,
     # apply scaling of data
     fracs = applyScaling(datain, scaling, minval, maxval)
 
-    img = numpyToQImage(fracs, cmap, transimg is not None)
-    if transimg is not None:
-        applyImageTransparancy(img, transimg)
-    return img
+    # colors and transparency applied in a single pass
+    return numpyToQImage(fracs, cmap, transimg, allowindexed, reuseimg)
 
 def makeColorbarImage(minval, maxval, scaling, cmap, transparency,
                       direction='horizontal', barsize=128):
@@ -36,62 +36,50 @@ def _(text, disambiguation=None, context='Image'):
 
 def cropLinearImageToBox(image, pltx, plty, posn):
     """Given a plotting range pltx[0]->pltx[1], plty[0]->plty[1] and
-    plotting bounds posn, return an image which is cropped to posn.
+    plotting bounds posn, return the part of the image within posn.
 
     Returns:
      - updated pltx range
      - updated plty range
-     - cropped image
+     - QRect of the part of the image to plot
     """
 
     x1, y1, x2, y2 = posn
     pltx1, pltx2 = pltx
-    pltw = pltx2-pltx1
     plty2, plty1 = plty
-    plth = plty2-plty1
 
     imw = image.width()
     imh = image.height()
-    pixw = pltw / imw
-    pixh = plth / imh
-    cutr = [0, 0, imw-1, imh-1]
+    pixw = (pltx2-pltx1) / imw
+    pixh = (plty2-plty1) / imh
 
     # work out where image intercepts posn, and make sure image
-    # fills at least that area
-
-    # need to chop left
-    if pltx1 < x1:
-        d = int((x1-pltx1) / pixw)
-        cutr[0] += d
-        pltx[0] += d*pixw
-
-    # need to chop right
-    if pltx2 > x2:
-        d = max(0, int((pltx2-x2) / pixw) - 1)
-        cutr[2] -= d
-        pltx[1] -= d*pixw
-
-    # chop top
-    if plty1 < y1:
-        d = int((y1-plty1) / pixh)
-        cutr[1] += d
-        plty[1] += d*pixh
-
-    # chop bottom
-    if plty2 > y2:
-        d = max(0, int((plty2-y2) / pixh) - 1)
-        cutr[3] -= d
-        plty[0] -= d*pixh
-
-    # create chopped-down image
-    newimage = image.copy(
-        cutr[0], cutr[1], cutr[2]-cutr[0]+1, cutr[3]-cutr[1]+1)
-
-    # return new image coordinates and image
-    return pltx, plty, newimage
+    # fills at least that area, by chopping whole pixels from the
+    # left, right, top and bottom (leaving an extra pixel at the
+    # right and bottom)
+    over = (
+        N.array([x1-pltx1, pltx2-x2, y1-plty1, plty2-y2]) /
+        N.array([pixw, pixw, pixh, pixh]) )
+    left, right, top, bottom = N.maximum(
+        N.floor(over).astype(int) - [0, 1, 0, 1], 0)
+
+    # region of image to plot
+    cutrect = qt.QRect(
+        int(left), int(top), int(imw-left-right), int(imh-top-bottom))
+
+    # return new image coordinates and region
+    pltx = N.array([pltx1 + left*pixw, pltx2 - right*pixw])
+    plty = N.array([plty2 - bottom*pixh, plty1 + top*pixh])
+    return pltx, plty, cutrect
 
 def cropGridImageToBox(image, gridx, gridy, posn):
-    """Given an image, pixel coordinates and box, crop image to box."""
+    """Given an image, pixel coordinates and box, crop image to box.
+
+    Returns:
+     - updated gridx
+     - updated gridy
+     - QRect of the part of the image to plot
+    """
 
     def trimGrid(grid, p1, p2):
         """Trim grid to bounds given, returning index range."""
@@ -99,7 +87,7 @@ def cropGridImageToBox(image, gridx, gridy, posn):
         if grid[0] < grid[-1]:
             # fwd order
             i1 = max(N.searchsorted(grid, p1, side='right')-1, 0)
-            i2 = min(N.searchsorted(grid, p2, side='left'), len(grid)) + 1
+            i2 = min(N.searchsorted(grid, p2, side='left')+1, len(grid))
 
         else:
             # reverse order of grid
@@ -107,8 +95,8 @@ def cropGridImageToBox(image, gridx, gridy, posn):
 
             i1 = max( len(grid) - N.searchsorted(gridr, p2, side='left')-1,
                       0)
-            i2 = min( len(grid) - N.searchsorted(gridr, p1, side='right'),
-                      len(grid) ) + 1
+            i2 = min( len(grid) - N.searchsorted(gridr, p1, side='right')+1,
+                      len(grid) )
 
         return i1, i2
 
@@ -125,9 +113,10 @@ def cropGridImageToBox(image, gridx, gridy, posn):
     x1, x2 = trimGrid(gridx, posn[0], posn[2])
     y1, y2 = trimGrid(gridy, posn[1], posn[3])
 
+    cutrect = image.rect()
     if x1 > 0 or y1 > 0 or x2 < len(gridx)-1 or y2 < len(gridy)-1:
         # do cropping
-        image = image.copy(x1, len(gridy)-y2, x2-x1-1, y2-y1-1)
+        cutrect = qt.QRect(x1, len(gridy)-y2, x2-x1-1, y2-y1-1)
         gridx = N.array(gridx[x1:x2])
         gridy = N.array(gridy[y1:y2])
 
@@ -135,7 +124,16 @@ def cropGridImageToBox(image, gridx, gridy, posn):
         trimEdge(gridx, posn[0], posn[2])
         trimEdge(gridy, posn[1], posn[3])
 
-    return gridx, gridy, image
+    return gridx, gridy, cutrect
+
+def isUniformGrid(grid):
+    """Are the values in grid equally spaced?"""
+
+    if len(grid) < 2:
+        return False
+    delta = N.diff(grid)
+    return delta[0] != 0 and N.all(
+        N.abs(delta-delta[0]) <= 1e-6*abs(delta[0]))
 
 class Image(plotters.GenericPlotter):
     """A class which plots an image on a graph with a specified
@@ -145,6 +143,42 @@ class Image(plotters.GenericPlotter):
     allowusercreation=True
     description=_('Plot a 2d dataset as an image')
 
+    def __init__(self, parent, name=None):
+        """Initialise plotter."""
+
+        plotters.GenericPlotter.__init__(self, parent, name=name)
+
+        # cached datasets and data ranges
+        self._cacheddata = None
+        self._datachangeset = -1
+
+        # colormap as an integer array, with the colormap definition
+        # and inversion it was made from
+        self._cachedcmap = None
+        self._cmapkey = (None, None)
+
+        # cached colormapped image and the settings used to make it
+        self._cachedimage = None
+        self._imagesettings = None
+        self._imagechangeset = -1
+
+        # cached pixel edges in plotter coordinates
+        self._cachededges = None
+        self._edgeskey = None
+
+        # cached crop region for linear images
+        self._cachedcrop = None
+        self._cropkey = None
+
+        # cached resampled image for nonlinear images
+        self._cachedresample = None
+        self._resamplekey = None
+
+        # cached minimum and maximum of data
+        self._minmax = None
+        self._minmaxdata = None
+        self._minmaxchangeset = -1
+
     @classmethod
     def addSettings(klass, s):
         """Construct list of settings."""
@@ -243,22 +277,53 @@ class Image(plotters.GenericPlotter):
         out += [s.colorScaling, s.colorMap]
         return ', '.join(out)
 
+    def getDatasets(self):
+        """Get the data and transparency datasets and the x and y
+        ranges of the data.
+
+        These are only looked up again if the document changes.
+        """
+
+        d = self.document
+        if self._datachangeset != d.changeset:
+            s = self.settings
+            data = s.get('data').getData(d)
+            transdata = s.get('transparencyData').getData(d)
+            ranges = None
+            if data is not None and data.dimensions == 2:
+                ranges = data.getDataRanges()
+            self._cacheddata = (data, transdata, ranges)
+            self._datachangeset = d.changeset
+        return self._cacheddata
+
+    def getDataMinMax(self, data):
+        """Get minimum and maximum of data, ignoring NaNs."""
+
+        d = self.document
+        if ( self._minmaxchangeset != d.changeset or
+             self._minmaxdata is not data ):
+            # single pass through data for both values
+            self._minmax = qtloops.nanMinMax(data.data.ravel())
+            self._minmaxchangeset = d.changeset
+            self._minmaxdata = data
+        return self._minmax
+
     def getDataValueRange(self, data):
         """Update data range from data."""
 
         s = self.settings
         minval = s.min
-        if minval == 'Auto':
-            if data is not None and len(data.data) != 0:
-                minval = N.nanmin(data.data)
-            else:
-                minval = 0.
         maxval = s.max
+
+        datamin = datamax = None
+        if ( (minval == 'Auto' or maxval == 'Auto') and
+             data is not None and len(data.data) != 0 ):
+            datamin, datamax = self.getDataMinMax(data)
+
+        if minval == 'Auto':
+            minval = 0. if datamin is None else datamin
         if maxval == 'Auto':
-            if data is not None and len(data.data) != 0:
-                maxval = N.nanmax(data.data)
-            else:
-                maxval = minval + 1
+            maxval = minval + 1 if datamax is None else datamax
 
         # this is used currently by colorbar objects
         return (minval, maxval)
@@ -271,16 +336,12 @@ class Image(plotters.GenericPlotter):
     def getRange(self, axis, depname, axrange):
         """Automatically determine the ranges of variable on the axes."""
 
-        # this is copied from Image, probably should combine
-        s = self.settings
-        d = self.document
-
         # return if no data
-        data = s.get('data').getData(d)
+        data, transdata, ranges = self.getDatasets()
         if data is None or data.dimensions != 2:
             return
 
-        xr, yr = data.getDataRanges()
+        xr, yr = ranges
         if depname == 'sx':
             axrange[0] = min( axrange[0], xr[0] )
             axrange[1] = max( axrange[1], xr[1] )
@@ -292,8 +353,7 @@ class Image(plotters.GenericPlotter):
         """Return parameters for colorbar."""
 
         s = self.settings
-        d = self.document
-        data = s.get('data').getData(d)
+        data = self.getDatasets()[0]
         minval, maxval = self.getDataValueRange(data)
 
         return (
@@ -304,15 +364,167 @@ class Image(plotters.GenericPlotter):
             s.colorInvert,
         )
 
+    def getColormap(self):
+        """Get the colormap as an integer array.
+
+        This is only remade if the colormap name, its definition or
+        inversion change.
+        """
+
+        s = self.settings
+        evaluate = self.document.evaluate
+
+        # colormap definitions are cached by name, so a new object is
+        # only returned if the definition changes
+        defn = evaluate.getColormap(s.colorMap, False)
+        if defn is not self._cmapkey[0] or s.colorInvert != self._cmapkey[1]:
+            self._cachedcmap = N.array(
+                evaluate.getColormap(s.colorMap, s.colorInvert),
+                dtype=N.intc)
+            self._cmapkey = (defn, s.colorInvert)
+        return self._cachedcmap
+
+    def makeColorImage(self, data, transimg):
+        """Return QImage of data with the colormap applied.
+
+        The image is only recomputed if the data or the settings used
+        to make it have changed.
+        """
+
+        s = self.settings
+        d = self.document
+
+        # nothing can have changed if the document hasn't
+        if self._imagechangeset == d.changeset:
+            return self._cachedimage
+
+        cmap = self.getColormap()
+        minval, maxval = self.getDataValueRange(data)
+
+        imagesettings = (
+            cmap.tostring(), s.colorScaling,
+            minval, maxval, s.transparency,
+            data.data.shape, hash(data.data.tostring()),
+            None if transimg is None else (
+                transimg.shape, hash(transimg.tostring())),
+        )
+
+        if imagesettings != self._imagesettings:
+            # the old image is replaced, so its buffer can be reused
+            # unless painted output still refers to it
+            self._cachedimage = utils.applyColorMap(
+                cmap,
+                s.colorScaling,
+                data.data,
+                minval, maxval,
+                s.transparency, transimg=transimg,
+                allowindexed=True, reuseimg=self._cachedimage,
+            )
+            self._imagesettings = imagesettings
+
+        self._imagechangeset = d.changeset
+        return self._cachedimage
+
+    def getPlotterPixelEdges(self, axes, posn, data):
+        """Get pixel edges of data, converted to plotter coordinates.
+
+        These are only recalculated if the document, position or axis
+        ranges have changed.
+        """
+
+        key = (self.document.changeset, tuple(posn)) + tuple(
+            (id(a), tuple(a.plottedrange)) for a in axes)
+
+        if key != self._edgeskey:
+            self._cachededges = data.getPixelEdges(
+                scalefnx=lambda v: axes[0].dataToPlotterCoords(posn, v),
+                scalefny=lambda v: axes[1].dataToPlotterCoords(posn, v))
+            self._edgeskey = key
+
+        return self._cachededges
+
+    def resampleImage(self, image, drawmode, xedgep, yedgep, cutrect,
+                      x0, y0, x1, y1):
+        """Resample region cutrect of a nonlinear image onto a regular
+        grid covering x0->x1, y0->y1 in plotter coordinates.
+
+        The output is kept and reused if called again with the same
+        image and coordinates, as this depends only on the image and
+        axis scales, not on anything else in the document.
+        """
+
+        key = (
+            image.cacheKey(), drawmode, cutrect.getRect(),
+            x0, y0, x1, y1, xedgep.tostring(), yedgep.tostring())
+        if key == self._resamplekey:
+            return self._cachedresample
+
+        if drawmode == 'resample-pixels':
+            if ( xedgep[0] < xedgep[-1] and yedgep[0] > yedgep[-1] and
+                 isUniformGrid(xedgep) and isUniformGrid(yedgep) ):
+                # pixels all the same size, so let Qt rescale
+                if cutrect != image.rect():
+                    image = image.copy(cutrect)
+                image = image.scaled(
+                    x1-x0, y1-y0,
+                    qt.Qt.IgnoreAspectRatio,
+                    qt.Qt.FastTransformation
+                )
+            else:
+                # resample image to a flat bitmap, reading
+                # directly from the region of the image required
+                image = qtloops.resampleNonlinearImage(
+                    image, x0, y0, x1, y1, xedgep, yedgep,
+                    cutrect.x(), cutrect.y())
+
+        elif drawmode == 'resample-smooth':
+            # render smaller and scale up to smooth
+            s = 4
+
+            # if the image has many more pixels than the smaller
+            # render, average it down first, so all pixels contribute
+            # and less data are resampled
+            w, h = len(xedgep)-1, len(yedgep)-1
+            nx = max((x1-x0)//s, 1)
+            ny = max((y1-y0)//s, 1)
+            nx = w if w <= 2*nx else nx
+            ny = h if h <= 2*ny else ny
+            if nx != w or ny != h:
+                image = image.copy(cutrect.x(), cutrect.y(), w, h).scaled(
+                    nx, ny,
+                    qt.Qt.IgnoreAspectRatio,
+                    qt.Qt.SmoothTransformation
+                )
+                cutrect = image.rect()
+                # edges of averaged pixels
+                xedgep = N.interp(
+                    N.arange(nx+1)*(w/nx), N.arange(w+1), xedgep)
+                yedgep = N.interp(
+                    N.arange(ny+1)*(h/ny), N.arange(h+1), yedgep)
+
+            image = qtloops.resampleNonlinearImage(
+                image, x0//s, y0//s, x1//s, y1//s,
+                xedgep/s, yedgep/s,
+                cutrect.x(), cutrect.y())
+            image = image.scaled(
+                x1-x0, y1-y0,
+                qt.Qt.IgnoreAspectRatio,
+                qt.Qt.SmoothTransformation
+            )
+        else:
+            raise RuntimeError('Invalid draw mode')
+
+        self._resamplekey = key
+        self._cachedresample = image
+        return image
+
     def drawNonlinearImage(self, painter, axes, posn, data, image):
         """Draw an image where the image data are non-linear, or the
         axes are non-linear."""
 
         drawmode = self.settings.drawMode
         # get pixel edges, converted to plotter coordinates
-        xedgep, yedgep = data.getPixelEdges(
-            scalefnx=lambda v: axes[0].dataToPlotterCoords(posn, v),
-            scalefny=lambda v: axes[1].dataToPlotterCoords(posn, v))
+        xedgep, yedgep = self.getPlotterPixelEdges(axes, posn, data)
 
         if drawmode == 'default' or drawmode == 'rectangles':
             # simply draw everything as boxes
@@ -322,32 +534,15 @@ class Image(plotters.GenericPlotter):
         else:
             # map image to a linear QImage
             # crop any pixels completely outside posn
-            xedgep, yedgep, image = cropGridImageToBox(
+            xedgep, yedgep, cutrect = cropGridImageToBox(
                 image, xedgep, yedgep, posn)
             x0 = int(min(xedgep[0], xedgep[-1]))
             x1 = int(max(xedgep[0], xedgep[-1]))
             y0 = int(min(yedgep[0], yedgep[-1]))
             y1 = int(max(yedgep[0], yedgep[-1]))
 
-            print(painter.device().logicalDpiY())
-            if drawmode == 'resample-pixels':
-                # resample image to a flat bitmap
-                image = qtloops.resampleNonlinearImage(
-                    image, x0, y0, x1, y1, xedgep, yedgep)
-
-            elif drawmode == 'resample-smooth':
-                # render smaller and scale up to smooth
-                s = 4
-                image = qtloops.resampleNonlinearImage(
-                    image, x0//s, y0//s, x1//s, y1//s,
-                    xedgep/s, yedgep/s)
-                image = image.scaled(
-                    x1-x0, y1-y0,
-                    qt.Qt.IgnoreAspectRatio,
-                    qt.Qt.SmoothTransformation
-                )
-            else:
-                raise RuntimeError('Invalid draw mode')
+            image = self.resampleImage(
+                image, drawmode, xedgep, yedgep, cutrect, x0, y0, x1, y1)
 
             imgposn = qt.QRectF(x0, y0, x1-x0, y1-y0)
             painter.drawImage(imgposn, image)
@@ -365,17 +560,14 @@ class Image(plotters.GenericPlotter):
         """Draw image."""
 
         s = self.settings
-        d = self.document
 
-        data = s.get('data').getData(d)
+        data, transdata, ranges = self.getDatasets()
         if s.hide or data is None or data.dimensions != 2:
             return
 
-        transimg = s.get('transparencyData').getData(d)
-        if transimg is not None:
-            transimg = transimg.data
+        transimg = None if transdata is None else transdata.data
 
-        rangex, rangey = data.getDataRanges()
+        rangex, rangey = ranges
         pltrangex = axes[0].dataToPlotterCoords(posn, N.array(rangex))
         pltrangey = axes[1].dataToPlotterCoords(posn, N.array(rangey))
 
@@ -385,15 +577,7 @@ class Image(plotters.GenericPlotter):
             return
 
         # make QImage from data
-        cmap = d.evaluate.getColormap(s.colorMap, s.colorInvert)
-        datavaluerange = self.getDataValueRange(data)
-        image = utils.applyColorMap(
-            cmap,
-            s.colorScaling,
-            data.data,
-            datavaluerange[0], datavaluerange[1],
-            s.transparency, transimg=transimg,
-        )
+        image = self.makeColorImage(data, transimg)
 
         drawmode = s.drawMode
 
@@ -408,11 +592,25 @@ class Image(plotters.GenericPlotter):
         # linearly spaced grid
 
         # avoid drawing pixels outside of axis range
-        if ( pltrangex[0]<posn[0] or pltrangex[1]>posn[2] or
-             pltrangey[0]<posn[1] or pltrangey[1]>posn[3] ):
-            # need to crop image
-            pltrangex, pltrangey, image = cropLinearImageToBox(
-                image, pltrangex, pltrangey, posn)
+        # the painter is already clipped to the axes, so only crop if
+        # whole pixels can be removed (this keeps the image written to
+        # exported files small when zoomed in)
+        pixw = abs(pltrangex[1]-pltrangex[0]) / image.width()
+        pixh = abs(pltrangey[0]-pltrangey[1]) / image.height()
+        if ( pltrangex[0]<posn[0]-pixw or pltrangex[1]>posn[2]+pixw or
+             pltrangey[0]>posn[3]+pixh or pltrangey[1]<posn[1]-pixh ):
+            # need to crop image (reusing the last crop if the image
+            # and view are unchanged)
+            cropkey = (
+                tuple(pltrangex), tuple(pltrangey), tuple(posn),
+                image.width(), image.height())
+            if cropkey != self._cropkey:
+                self._cachedcrop = cropLinearImageToBox(
+                    image, pltrangex, pltrangey, posn)
+                self._cropkey = cropkey
+            pltrangex, pltrangey, cutrect = self._cachedcrop
+        else:
+            cutrect = image.rect()
 
         # invert output drawing if axes go from positive->negative
         # we only translate the coordinate system if this is the case
@@ -435,25 +633,37 @@ class Image(plotters.GenericPlotter):
             abs(pltrangey[0]-pltrangey[1]))
 
         drawmode = s.drawMode
-        if drawmode == 'rectangles' or (drawmode =='default' and (
-                image.width()<30 or image.height()<30)):
+        if drawmode == 'default' and (
+                cutrect.width()<30 or cutrect.height()<30):
             # draw low res images as rectangles
-            qtloops.plotImageAsRects(painter, imgposn, image)
+            drawmode = 'rectangles'
+
+        if drawmode == 'default':
+            # draw the required part of the image directly, avoiding
+            # making a cropped copy
+            painter.drawImage(imgposn, image, qt.QRectF(cutrect))
 
         else:
-            # upscale if requested
-            if drawmode == 'resample-pixels':
-                image = image.scaled(
-                    int(pltrangex[1]-pltrangex[0]),
-                    int(pltrangey[0]-pltrangey[1]),
-                    qt.Qt.IgnoreAspectRatio, qt.Qt.FastTransformation)
-            elif drawmode == 'resample-smooth':
-                image = image.scaled(
-                    int(pltrangex[1]-pltrangex[0]),
-                    int(pltrangey[0]-pltrangey[1]),
-                    qt.Qt.IgnoreAspectRatio, qt.Qt.SmoothTransformation)
+            # other modes need an image of just the region to draw
+            if cutrect != image.rect():
+                image = image.copy(cutrect)
 
-            painter.drawImage(imgposn, image)
+            if drawmode == 'rectangles':
+                qtloops.plotImageAsRects(painter, imgposn, image)
+            else:
+                # upscale if requested
+                if drawmode == 'resample-pixels':
+                    image = image.scaled(
+                        int(pltrangex[1]-pltrangex[0]),
+                        int(pltrangey[0]-pltrangey[1]),
+                        qt.Qt.IgnoreAspectRatio, qt.Qt.FastTransformation)
+                elif drawmode == 'resample-smooth':
+                    image = image.scaled(
+                        int(pltrangex[1]-pltrangex[0]),
+                        int(pltrangey[0]-pltrangey[1]),
+                        qt.Qt.IgnoreAspectRatio, qt.Qt.SmoothTransformation)
+
+                painter.drawImage(imgposn, image)
 
         painter.restore()
 